@@ -19,7 +19,9 @@ def create_app(socketio):
 
     # Register blueprints
     from routes.main import main_bp
+    from routes.admin import admin_bp
     app.register_blueprint(main_bp)
+    app.register_blueprint(admin_bp)
 
     # Initialize SocketIO with the app
     socketio.init_app(app)
@@ -28,7 +30,8 @@ def create_app(socketio):
     # This avoids circular imports
     with app.app_context():
         from sockets.handlers import register_socket_handlers
-        register_socket_handlers(socketio)
+        # Background workers are kept so /ready can check they are still running
+        app.extensions['workers'] = register_socket_handlers(socketio)
 
     return app
 
@@ -0,0 +1,63 @@
+"""
+Benchmark of direct message routing with 1, 10 and 50 @mentions.
+
+Compares the grouped path (one-pass parse, batched routing lookup and a
+single emit) with resolving and delivering each mention separately.
+
+Usage:
+    python benchmarks/bench_mentions.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mentions import parse_mentions
+from models.user import UserManager
+from timestamps import timestamp_service
+
+def make_manager(count):
+    """A user manager where every other mentioned user is online."""
+    manager = UserManager()
+    for i in range(0, count, 2):
+        manager.add_user(f'sid-{i}', f'User{i}', 'general')
+    return manager
+
+def emit(*args, **kwargs):
+    """Stand-in for socketio emit; counts calls."""
+    emit.calls += 1
+emit.calls = 0
+
+def grouped(manager, text, message_data):
+    recipients, body = parse_mentions(text)
+    delivery = manager.route_direct_message('sender', recipients, {**message_data, 'message': body})
+    if delivery['sids']:
+        emit('message', to=delivery['sids'])
+
+def per_mention(manager, text, message_data):
+    recipients = [word[1:] for word in text.split(' ') if word.startswith('@')]
+    body = ' '.join(word for word in text.split(' ') if not word.startswith('@'))
+    for recipient in recipients:
+        data = {**message_data, 'message': body}
+        manager.add_to_conversation('sender', recipient, data)
+        sids = manager.get_sids(recipient)
+        if sids:
+            for sid in sids:
+                emit('message', room=sid)
+        else:
+            manager.add_offline_message(recipient, data)
+
+def main(number=2000):
+    for count in (1, 10, 50):
+        text = ' '.join(f'@User{i}' for i in range(count)) + ' hello there'
+        message_data = {'id': 'bench', 'username': 'sender', **timestamp_service.stamp()}
+        for name, func in (('grouped', grouped), ('per-mention', per_mention)):
+            manager = make_manager(count)
+            emit.calls = 0
+            best = min(timeit.repeat(lambda: func(manager, text, message_data), number=number, repeat=5))
+            emits = emit.calls / (number * 5)
+            print(f"{count:>3} mentions  {name:<12} {best / number * 1e6:8.2f} us/message  {emits:5.1f} emits/message")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Micro-benchmark of the per-message timestamp overhead.
+
+Compares formatting the wall clock on every message with the cached
+timestamp service.
+
+Usage:
+    python benchmarks/bench_timestamps.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from timestamps import TimestampService
+
+def main(number=200000):
+    service = TimestampService(config.MESSAGE_TIMESTAMP_FORMAT)
+
+    cases = {
+        'datetime.now().strftime': lambda: datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT),
+        'TimestampService.format(now)': lambda: service.format(service.now()),
+        'TimestampService.stamp': service.stamp,
+    }
+
+    for name, func in cases.items():
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:<30} {best / number * 1e9:8.1f} ns/message")
+
+if __name__ == '__main__':
+    main()
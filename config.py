@@ -14,6 +14,21 @@ class Config:
     
     # Room settings
     DEFAULT_ROOM = 'general'
+    ROOM_HISTORY_SIZE = 50  # Recent messages kept per room for join backfill
+    
+    # User routing settings
+    ROUTING_SHARDS = 16  # Independently locked shards of the username routing table
+    
+    # Typing indicator and read receipt settings (seconds)
+    TYPING_DEBOUNCE = 2.0  # Ignore repeated typing events from a socket within this window
+    TYPING_TIMEOUT = 5.0  # Stop showing a user as typing after this long without an event
+    ACTIVITY_FLUSH_INTERVAL = 0.5  # How often typing/read deltas are sent to rooms
+    
+    # Handler profiling settings
+    PROFILE_HANDLERS = False  # Record timings for every Socket.IO handler
+    SLOW_HANDLER_THRESHOLD_MS = 100  # Log handlers slower than this with a stack sample
+    PROFILER_SAMPLE_INTERVAL_MS = 10  # Stack sampling interval while the profiler is on
+    ADMIN_TOKEN = None  # Token for /admin routes (X-Admin-Token header); routes are disabled if unset
 
 # Create instance of config for import
 config = Config()
@@ -0,0 +1,309 @@
+"""
+Opt-in instrumentation and sampling profiler for Socket.IO event handlers.
+"""
+import _thread
+import functools
+import inspect
+import itertools
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Any, Callable
+
+from config import config
+
+# Only consult eventlet if it is already loaded (e.g. by wsgi.py); without
+# it nothing is monkey patched, and importing it would slow down startup.
+if 'eventlet' in sys.modules:
+    from eventlet import patcher as _eventlet_patcher
+else:
+    _eventlet_patcher = None
+
+def _original(module_name: str, default):
+    """Get a module as it was before eventlet monkey patching, if eventlet is present."""
+    if _eventlet_patcher is None:
+        return default
+    return _eventlet_patcher.original(module_name)
+
+# The watchdog has to be a real OS thread so it can still run while a
+# handler is blocking the eventlet hub.
+_real_thread = _original('_thread', _thread)
+_real_time = _original('time', time)
+
+# Reused encoder; json.dumps(default=...) builds a new encoder on every call
+_payload_encoder = json.JSONEncoder(default=str)
+
+# CPU time (a system call) and payload size (a JSON encode) are the most
+# expensive parts of a measurement, so only every Nth call measures them.
+DETAIL_SAMPLE_EVERY = 8
+
+# Stack sample marker for a slow handler that was not running when sampled
+# (it had yielded to the eventlet hub, e.g. waiting on I/O or sleeping).
+_YIELDED = 'yielded'
+
+class _HandlerStats:
+    """Running totals for one event."""
+
+    __slots__ = ('calls', 'wall', 'max_wall', 'emits', 'slow', 'cpu', 'payload_bytes', 'detail_samples')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = self.emits = self.slow = self.payload_bytes = self.detail_samples = 0
+        self.wall = self.max_wall = self.cpu = 0.0
+
+class HandlerProfiler:
+    """
+    Records per-event timings for Socket.IO handlers and samples slow ones.
+
+    Features:
+    - Wall time and emits per call, CPU time and payload size on sampled calls
+    - Stack sample of handlers running longer than the slow threshold
+    - Sampling profiler that can be toggled at runtime
+    """
+
+    def __init__(self, slow_threshold_ms: float = 100.0, sample_interval_ms: float = 10.0):
+        """
+        Initialize the profiler.
+
+        Args:
+            slow_threshold_ms: Handlers running longer than this are logged with a stack sample
+            sample_interval_ms: Interval between stack samples while the sampling profiler is on
+        """
+        self.slow_threshold = slow_threshold_ms / 1000.0
+        self.sample_interval = sample_interval_ms / 1000.0
+        self.sampling = False
+        self.stats: Dict[str, _HandlerStats] = {}
+        self.samples: Counter = Counter()
+        self._local = threading.local()
+        self._lock = _real_thread.allocate_lock()
+        # {token: (os_thread_id, wrapper_frame, start)} for handlers currently running
+        self._active: Dict[int, tuple] = {}
+        self._stack_samples: Dict[int, str] = {}
+        self._tokens = itertools.count(1)
+        self._watchdog_id = None
+
+    def on(self, socketio) -> Callable:
+        """
+        Get a drop-in replacement for ``socketio.on`` that instruments each handler.
+
+        Args:
+            socketio: The SocketIO instance handlers are registered on
+
+        Returns:
+            Callable: Decorator factory with the same signature as ``socketio.on``
+        """
+        self._count_emits(socketio)
+        self._start_watchdog()
+
+        def on(message, namespace=None):
+            register = socketio.on(message, namespace)
+
+            def decorator(handler):
+                register(self.wrap(message, handler))
+                return handler
+            return decorator
+        return on
+
+    def wrap(self, event: str, handler: Callable) -> Callable:
+        """Wrap a single handler so its calls are recorded under ``event``."""
+        # Totals are updated without a lock: under eventlet all handlers share
+        # one OS thread, and with real threads a rare lost update only skews averages.
+        stats = self.stats.setdefault(event, _HandlerStats())
+
+        # Flask-SocketIO calls connect/disconnect handlers with an argument first
+        # and retries without it on TypeError; a call that does not fit the
+        # handler's signature must fail before anything is recorded.
+        signature = inspect.signature(handler)
+        kinds = [p.kind for p in signature.parameters.values()]
+        positional = [p for p in signature.parameters.values()
+                      if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+        if inspect.Parameter.VAR_POSITIONAL in kinds:
+            max_args = None
+        else:
+            max_args = len(positional)
+        min_args = sum(1 for p in positional if p.default is p.empty)
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            if kwargs or len(args) < min_args or (max_args is not None and len(args) > max_args):
+                signature.bind(*args, **kwargs)  # Raises TypeError if the call does not fit
+            local = self._local
+            local.emits = 0
+            token = next(self._tokens)
+            detailed = token % DETAIL_SAMPLE_EVERY == 0
+            start = time.perf_counter()
+            start_cpu = time.thread_time() if detailed else 0.0
+            self._active[token] = (_real_thread.get_ident(), sys._getframe(), start)
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                wall = time.perf_counter() - start
+                cpu = payload_bytes = None
+                if detailed:
+                    cpu = time.thread_time() - start_cpu
+                    payload_bytes = self._payload_size(args)
+                del self._active[token]
+                emits = local.emits
+                stats.calls += 1
+                stats.wall += wall
+                stats.emits += emits
+                if wall > stats.max_wall:
+                    stats.max_wall = wall
+                if detailed:
+                    stats.cpu += cpu
+                    stats.payload_bytes += payload_bytes
+                    stats.detail_samples += 1
+                if wall >= self.slow_threshold:
+                    stats.slow += 1
+                    stack = self._stack_samples.pop(token, None)
+                    cpu_text = f"{cpu * 1000:.1f} ms CPU" if cpu is not None else "CPU not sampled"
+                    print(f"[Profiler] Slow handler '{event}': {wall * 1000:.1f} ms wall, "
+                          f"{cpu_text}, {emits} emits")
+                    if stack == _YIELDED:
+                        print(f"[Profiler] '{event}' had yielded (not on CPU) when sampled")
+                    elif stack:
+                        print(f"[Profiler] Stack sample for '{event}':\n{stack}")
+        return wrapper
+
+    def _count_emits(self, socketio):
+        """Count emits made while a handler runs (``flask_socketio.emit`` goes through ``socketio.emit``)."""
+        if getattr(socketio.emit, '_profiled', False):
+            return
+        original_emit = socketio.emit
+        local = self._local
+
+        @functools.wraps(original_emit)
+        def emit(*args, **kwargs):
+            local.emits = getattr(local, 'emits', 0) + 1
+            return original_emit(*args, **kwargs)
+        emit._profiled = True
+        socketio.emit = emit
+
+    @staticmethod
+    def _payload_size(args) -> int:
+        """Approximate size in bytes of a handler's JSON payload."""
+        if not args:
+            return 0
+        try:
+            return len(_payload_encoder.encode(args))
+        except (TypeError, ValueError):
+            return 0
+
+    def _start_watchdog(self):
+        with self._lock:
+            if self._watchdog_id is None:
+                self._watchdog_id = _real_thread.start_new_thread(self._watchdog_loop, ())
+
+    def _watchdog_loop(self):
+        """Take stack samples of slow handlers and, when enabled, of all threads."""
+        while True:
+            interval = self.slow_threshold / 2
+            if self.sampling:
+                interval = min(interval, self.sample_interval)
+            _real_time.sleep(interval)
+
+            frames = None
+            now = time.perf_counter()
+            for token, (thread_id, handler_frame, start) in list(self._active.items()):
+                if self._stack_samples.get(token, _YIELDED) != _YIELDED:
+                    continue  # Already have a real sample
+                if now - start < self.slow_threshold:
+                    continue
+                frames = frames or sys._current_frames()
+                frame = frames.get(thread_id)
+                # Under eventlet every greenlet shares the OS thread, so the
+                # thread's current frame only belongs to this handler if the
+                # handler's wrapper frame is on that stack.
+                if self._on_stack(handler_frame, frame):
+                    sample = ''.join(traceback.format_stack(frame))
+                else:
+                    sample = _YIELDED
+                self._stack_samples[token] = sample
+                if token not in self._active:
+                    # The handler finished while we were sampling it
+                    self._stack_samples.pop(token, None)
+
+            if self.sampling:
+                frames = frames or sys._current_frames()
+                with self._lock:
+                    for thread_id, frame in frames.items():
+                        if thread_id != self._watchdog_id:
+                            self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _on_stack(target, frame) -> bool:
+        """Check if ``target`` is ``frame`` or one of its callers."""
+        while frame is not None:
+            if frame is target:
+                return True
+            frame = frame.f_back
+        return False
+
+    @staticmethod
+    def _collapse(frame, limit: int = 40) -> str:
+        """Render a frame's stack as 'file:function;...' from the outermost call."""
+        parts = []
+        while frame is not None and len(parts) < limit:
+            code = frame.f_code
+            parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def start_sampling(self):
+        """Turn the sampling profiler on."""
+        self._start_watchdog()
+        self.sampling = True
+
+    def stop_sampling(self):
+        """Turn the sampling profiler off, keeping collected samples."""
+        self.sampling = False
+
+    def reset(self):
+        """Clear handler statistics and collected samples."""
+        with self._lock:
+            for stats in self.stats.values():
+                stats.reset()
+            self.samples.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get per-event handler statistics.
+
+        Returns:
+            Dict: {event: {'calls', 'avg_wall_ms', 'avg_cpu_ms', 'max_wall_ms',
+                           'avg_emits', 'avg_payload_bytes', 'slow'}}
+        """
+        result = {}
+        for event, stats in list(self.stats.items()):
+            if not stats.calls:
+                continue
+            samples = stats.detail_samples or 1
+            result[event] = {
+                'calls': stats.calls,
+                'avg_wall_ms': stats.wall / stats.calls * 1000,
+                'avg_cpu_ms': stats.cpu / samples * 1000,
+                'max_wall_ms': stats.max_wall * 1000,
+                'avg_emits': stats.emits / stats.calls,
+                'avg_payload_bytes': stats.payload_bytes / samples,
+                'slow': stats.slow
+            }
+        return result
+
+    def get_profile(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get the most frequently sampled stacks, most common first."""
+        with self._lock:
+            return [
+                {'stack': stack, 'samples': count}
+                for stack, count in self.samples.most_common(limit)
+            ]
+
+# Global handler profiler instance
+handler_profiler = HandlerProfiler(
+    slow_threshold_ms=config.SLOW_HANDLER_THRESHOLD_MS,
+    sample_interval_ms=config.PROFILER_SAMPLE_INTERVAL_MS
+)
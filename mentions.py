@@ -0,0 +1,48 @@
+"""
+@mention parsing for direct messages.
+"""
+import re
+from typing import List, Tuple
+
+from models.routing import canonical_username
+
+# A mention is '@' followed by a username, not preceded by a word character
+# (so e-mail addresses are not mentions). Trailing dots/dashes are punctuation.
+MENTION_PATTERN = re.compile(r'(?<![\w@])@(\w(?:[\w.-]*\w)?)')
+
+# Characters allowed between and after the leading mentions, e.g. "@alice, @bob: hi"
+MENTION_SEPARATORS = ',:; \t\r\n'
+
+def parse_mentions(text: str) -> Tuple[List[str], str]:
+    """
+    Extract all @mentions from a message in a single pass.
+
+    Mentions at the start of the message address it and are removed from the
+    body; mentions later in the text are kept in the body but still count as
+    recipients.
+
+    Args:
+        text: Message text
+
+    Returns:
+        Tuple: (usernames in order of first mention, without case-insensitive
+                duplicates; message body without the leading mentions)
+    """
+    recipients = []
+    seen = set()
+    body_start = 0
+    leading = True
+
+    for match in MENTION_PATTERN.finditer(text):
+        if leading and not text[body_start:match.start()].strip(MENTION_SEPARATORS):
+            body_start = match.end()
+        else:
+            leading = False
+
+        username = match.group(1)
+        key = canonical_username(username)
+        if key not in seen:
+            seen.add(key)
+            recipients.append(username)
+
+    return recipients, text[body_start:].lstrip(MENTION_SEPARATORS).rstrip()
@@ -0,0 +1,134 @@
+"""
+Username to socket ID routing for the chat application.
+"""
+import itertools
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+def canonical_username(username: str) -> str:
+    """Get the case-insensitive key for a username."""
+    return username.casefold()
+
+class _Shard:
+    """One lock-protected slice of the routing table."""
+
+    __slots__ = ('lock', 'routes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {canonical_username: {sid: generation}}; insertion order is join order
+        self.routes: Dict[str, Dict[str, int]] = {}
+
+class RoutingTable:
+    """
+    Maps casefolded usernames to the set of live socket IDs (one per device).
+
+    Features:
+    - O(1) case-insensitive lookup
+    - Sharded by username so unrelated users do not contend on one lock
+    - Generation counters so a stale disconnect cannot remove a newer session
+    """
+
+    def __init__(self, shards: int = 16):
+        """
+        Initialize the routing table.
+
+        Args:
+            shards: Number of independently locked shards
+        """
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._generations = itertools.count(1)
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def add(self, username: str, sid: str) -> Tuple[int, bool]:
+        """
+        Register a live session for a user.
+
+        Args:
+            username: User's display name
+            sid: Socket ID of the session
+
+        Returns:
+            Tuple: (generation of this registration, needed to remove it again;
+                    True if the user had no other live session)
+        """
+        key = canonical_username(username)
+        generation = next(self._generations)
+        shard = self._shard(key)
+        with shard.lock:
+            sids = shard.routes.setdefault(key, {})
+            sids.pop(sid, None)
+            first_session = not sids
+            sids[sid] = generation
+        return generation, first_session
+
+    def remove(self, username: str, sid: str, generation: Optional[int] = None) -> bool:
+        """
+        Remove a session, unless it has since been registered again.
+
+        Args:
+            username: User's display name
+            sid: Socket ID of the session
+            generation: Generation returned by ``add``; if given, the session is
+                only removed when it still has this generation
+
+        Returns:
+            bool: True if the user still has other live sessions
+        """
+        key = canonical_username(username)
+        shard = self._shard(key)
+        with shard.lock:
+            sids = shard.routes.get(key)
+            if not sids:
+                return False
+            if sid in sids and (generation is None or sids[sid] == generation):
+                del sids[sid]
+            if not sids:
+                del shard.routes[key]
+                return False
+            return True
+
+    def get_sids(self, username: str) -> Tuple[str, ...]:
+        """Get a user's live socket IDs, oldest session first."""
+        key = canonical_username(username)
+        shard = self._shard(key)
+        with shard.lock:
+            return tuple(shard.routes.get(key, ()))
+
+    def get_many(self, usernames: Iterable[str]) -> Dict[str, Tuple[str, ...]]:
+        """
+        Resolve several users at once, taking each shard's lock only once.
+
+        Args:
+            usernames: Usernames to look up
+
+        Returns:
+            Dict: {canonical_username: (sid, ...)}; offline users map to an empty tuple
+        """
+        by_shard: Dict[int, List[str]] = {}
+        for username in usernames:
+            key = canonical_username(username)
+            by_shard.setdefault(hash(key) % len(self._shards), []).append(key)
+
+        result = {}
+        for index, keys in by_shard.items():
+            shard = self._shards[index]
+            with shard.lock:
+                for key in keys:
+                    result[key] = tuple(shard.routes.get(key, ()))
+        return result
+
+    def is_online(self, username: str) -> bool:
+        """Check if a user has at least one live session."""
+        key = canonical_username(username)
+        return key in self._shard(key).routes
+
+    def usernames(self) -> List[str]:
+        """Get the canonical usernames of all online users."""
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.routes)
+        return result
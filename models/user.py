@@ -3,18 +3,24 @@ User and session management for the chat application.
 """
 from collections import defaultdict
 import time
+
+from config import config
+from models.routing import RoutingTable, canonical_username
+from timestamps import timestamp_service
+
 class UserManager:
     """
     Manages users, their sessions, offline messages, and conversations.
     
     Data Structures:
-    - users: {socket_id: {'username': str, 'room': str, 'username_lower': str}}
+    - users: {socket_id: {'sid': str, 'username': str, 'room': str,
+                          'username_lower': str, 'generation': int}}
     - offline_messages: {username: [message1, message2, ...]}
-    - username_to_sid: {username: socket_id} (case-insensitive)
-    - active_usernames: set of lowercase usernames
+    - routes: RoutingTable of casefolded username -> live socket IDs (multi-device)
     - conversations: {
         'user1_user2': [
-            {'from': 'user1', 'to': 'user2', 'message': '...', 'timestamp': '...', 'delivered': bool},
+            {'from': 'user1', 'to': 'user2', 'message': '...', 'timestamp': '...',
+             'server_ts': float, 'seq': int, 'delivered': bool},
             ...
         ]
     }
@@ -23,13 +29,15 @@ class UserManager:
     def __init__(self):
         self.users = {}  # Active users by socket ID
         self.offline_messages = defaultdict(list)  # Messages for offline users
-        self.username_to_sid = {}  # Username to socket ID mapping
-        self.active_usernames = set()  # Set of active usernames (lowercase)
+        self.routes = RoutingTable(config.ROUTING_SHARDS)  # Username to socket IDs
         self.conversations = defaultdict(list)  # Stores conversation history between users
     
     def add_user(self, sid, username, room):
         """
-        Add a new user to the system.
+        Add a new session for a user.
+        
+        A user may have several live sessions (devices); each socket ID is
+        routed independently.
         
         Args:
             sid: Socket ID
@@ -37,89 +45,79 @@ class UserManager:
             room: Room name
             
         Returns:
-            str: Lowercase username
+            tuple: (canonical (casefolded) username, True if this is the
+                user's only live session)
         """
-        username_lower = username.lower()
-        
-        # If user exists with different socket ID, clean up old connection
-        old_sid = self.username_to_sid.get(username_lower)
-        if old_sid and old_sid in self.users:
-            # Transfer any undelivered messages to the new connection
-            old_user_data = self.users[old_sid]
-            if 'undelivered_messages' in old_user_data:
-                undelivered = old_user_data.get('undelivered_messages', [])
-                self.offline_messages[username_lower].extend(undelivered)
-        
-        # Add/update user
+        username_lower = canonical_username(username)
+        
+        # The same socket joining again replaces its previous registration
+        if sid in self.users:
+            self.remove_user(sid)
+        
+        generation, first_session = self.routes.add(username, sid)
         self.users[sid] = {
+            'sid': sid,
             'username': username,
             'room': room,
             'username_lower': username_lower,
+            'generation': generation,
             'undelivered_messages': [],
             'last_seen': time.time()
         }
         
-        # Update username to socket_id mapping
-        self.username_to_sid[username] = sid
-        self.username_to_sid[username_lower] = sid
-        self.active_usernames.add(username_lower)
-        
         # Deliver any pending messages
         self._deliver_pending_messages(username_lower, sid)
         
-        return username_lower
+        return username_lower, first_session
     
     def remove_user(self, sid):
         """
-        Remove a user from the system.
+        Remove a session from the system.
         
         Args:
-            sid: Socket ID of the user to remove
+            sid: Socket ID of the session to remove
             
         Returns:
-            dict: Removed user's data or None if not found
+            dict: Removed user's data, with 'online' telling whether the user
+                still has other live sessions, or None if not found
         """
-        if sid not in self.users:
+        user_data = self.users.pop(sid, None)
+        if user_data is None:
             return None
-            
-        user_data = self.users[sid]
+        
         username = user_data['username']
-        username_lower = user_data.get('username_lower', username.lower())
-        room = user_data['room']
+        username_lower = user_data['username_lower']
         
         # Store undelivered messages
-        if 'undelivered_messages' in user_data and user_data['undelivered_messages']:
+        if user_data['undelivered_messages']:
             self.offline_messages[username_lower].extend(user_data['undelivered_messages'])
         
-        # Clean up user data
-        if username in self.username_to_sid:
-            del self.username_to_sid[username]
-        if username_lower in self.username_to_sid:
-            del self.username_to_sid[username_lower]
-        if username_lower in self.active_usernames:
-            self.active_usernames.remove(username_lower)
-        
-        # Remove from users
-        del self.users[sid]
+        # Only this session's route is removed; newer sessions keep theirs
+        still_online = self.routes.remove(username, sid, user_data['generation'])
         
         return {
             'username': username,
-            'room': room,
-            'username_lower': username_lower
+            'room': user_data['room'],
+            'username_lower': username_lower,
+            'online': still_online
         }
     
     def get_user(self, sid):
         """Get user data by socket ID."""
         return self.users.get(sid)
     
+    def get_sids(self, username):
+        """Get the live socket IDs of a user (case-insensitive), oldest first."""
+        return self.routes.get_sids(username)
+    
     def get_user_by_username(self, username):
-        """Get user data by username (case-insensitive)."""
-        username_lower = username.lower()
-        if username_lower not in self.active_usernames:
-            return None
-            
-        sid = self.username_to_sid.get(username_lower)
-        return self.users.get(sid) if sid else None
+        """Get user data of a user's most recent session (case-insensitive)."""
+        sids = self.routes.get_sids(username)
+        return self.users.get(sids[-1]) if sids else None
+    
+    def get_active_usernames(self):
+        """Get the canonical usernames of all online users."""
+        return self.routes.usernames()
     
     def add_offline_message(self, target_username, message):
         """
@@ -130,25 +128,17 @@ class UserManager:
             message: Message data to store
             
         Returns:
-            bool: True if message was stored, False if user is online
+            bool: True if message was stored
         """
-        username_lower = target_username.lower()
+        username_lower = canonical_username(target_username)
         
         # If user is online but not in the same room, store as undelivered
-        if username_lower in self.active_usernames:
-            target_sid = self.username_to_sid.get(username_lower)
-            if target_sid and target_sid in self.users:
-                user_data = self.users[target_sid]
-                if 'undelivered_messages' not in user_data:
-                    user_data['undelivered_messages'] = []
-                user_data['undelivered_messages'].append(message)
-                return True
-            return False
+        user_data = self.get_user_by_username(target_username)
+        if user_data:
+            user_data['undelivered_messages'].append(message)
+            return True
             
         # Store the message for when user comes online
-        if username_lower not in self.offline_messages:
-            self.offline_messages[username_lower] = []
-            
         self.offline_messages[username_lower].append(message)
         return True
     
@@ -159,22 +149,24 @@ class UserManager:
             self.offline_messages[username_lower] = []
             
             # Add to undelivered messages for the user
-            if sid in self.users and 'undelivered_messages' in self.users[sid]:
+            if sid in self.users:
                 self.users[sid]['undelivered_messages'].extend(messages)
             return messages
         return []
     
-    def get_offline_messages(self, username):
+    def get_offline_messages(self, username, sid=None):
         """
         Get and clear offline messages for a user.
         
         Args:
             username: Username to get messages for
+            sid: Session to drain undelivered messages from; all of the
+                user's sessions if not given
             
         Returns:
             list: List of pending messages for the user
         """
-        username_lower = username.lower()
+        username_lower = canonical_username(username)
         
         # Get messages from offline storage
         messages = []
@@ -183,14 +175,20 @@ class UserManager:
             self.offline_messages[username_lower] = []
             
         # Get undelivered messages if user is online
-        if username_lower in self.active_usernames:
-            sid = self.username_to_sid.get(username_lower)
-            if sid and sid in self.users and 'undelivered_messages' in self.users[sid]:
-                messages.extend(self.users[sid]['undelivered_messages'])
-                self.users[sid]['undelivered_messages'] = []
+        sids = (sid,) if sid else self.routes.get_sids(username)
+        for session_sid in sids:
+            user_data = self.users.get(session_sid)
+            if user_data and user_data['undelivered_messages']:
+                messages.extend(user_data['undelivered_messages'])
+                user_data['undelivered_messages'] = []
                 
         return messages
         
+    def get_conversation_id(self, user1, user2):
+        """Get the consistent conversation ID for two users (alphabetical order)."""
+        user1, user2 = sorted([canonical_username(user1), canonical_username(user2)])
+        return f"{user1}_{user2}"
+        
     def add_to_conversation(self, sender, recipient, message_data):
         """
         Add a message to the conversation history between two users.
@@ -203,21 +201,79 @@ class UserManager:
         Returns:
             str: Conversation ID
         """
-        # Create a consistent conversation ID (alphabetical order)
-        user1, user2 = sorted([sender.lower(), recipient.lower()])
-        conv_id = f"{user1}_{user2}"
+        conv_id = self.get_conversation_id(sender, recipient)
+        
+        # Messages that were not stamped by the handler get stamped here
+        if 'seq' not in message_data:
+            message_data = {**timestamp_service.stamp(), **message_data}
         
         # Add to conversation history
         self.conversations[conv_id].append({
             'from': sender,
             'to': recipient,
             'message': message_data['message'],
-            'timestamp': message_data.get('timestamp', time.time()),
+            'timestamp': message_data['timestamp'],
+            'server_ts': message_data['server_ts'],
+            'seq': message_data['seq'],
             'delivered': False
         })
         
         return conv_id
         
+    def has_message_from(self, sender, recipient, seq):
+        """
+        Check if a direct message with the given sequence number was sent from one user to another.
+        
+        Args:
+            sender: Username of the sender
+            recipient: Username of the recipient
+            seq: Sequence number of the message
+            
+        Returns:
+            bool: True if the conversation holds such a message
+        """
+        sender_key = canonical_username(sender)
+        conversation = self.conversations.get(self.get_conversation_id(sender, recipient), ())
+        # Receipts are almost always for recent messages, so search from the end
+        return any(
+            msg['seq'] == seq and canonical_username(msg['from']) == sender_key
+            for msg in reversed(conversation)
+        )
+        
+    def route_direct_message(self, sender, recipients, message_data):
+        """
+        Record a direct message to several users and sort out its delivery.
+        
+        Recipients are resolved with one batched routing lookup. The message is
+        added to each conversation and buffered for offline recipients; sending
+        to the online sessions is left to the caller, as a single emit.
+        
+        Args:
+            sender: Username of the sender
+            recipients: Usernames of the recipients
+            message_data: Message data to store
+            
+        Returns:
+            dict: {'sids': socket IDs of online recipients,
+                   'online': online usernames, 'offline': offline usernames}
+        """
+        routes = self.routes.get_many(recipients)
+        sids = []
+        online = []
+        offline = []
+        
+        for recipient in recipients:
+            self.add_to_conversation(sender, recipient, message_data)
+            recipient_sids = routes[canonical_username(recipient)]
+            if recipient_sids:
+                sids.extend(recipient_sids)
+                online.append(recipient)
+            else:
+                self.offline_messages[canonical_username(recipient)].append(message_data)
+                offline.append(recipient)
+        
+        return {'sids': sids, 'online': online, 'offline': offline}
+        
     def get_conversation(self, user1, user2):
         """
         Get conversation history between two users.
@@ -229,26 +285,25 @@ class UserManager:
         Returns:
             list: Conversation history
         """
-        user1, user2 = sorted([user1.lower(), user2.lower()])
-        conv_id = f"{user1}_{user2}"
+        conv_id = self.get_conversation_id(user1, user2)
         return self.conversations.get(conv_id, []).copy()
         
-    def mark_messages_delivered(self, sender, recipient, before_time=None):
+    def mark_messages_delivered(self, sender, recipient, before_seq=None):
         """
         Mark messages as delivered in a conversation.
         
         Args:
             sender: Username of the message sender
             recipient: Username of the message recipient
-            before_time: Only mark messages before this timestamp as delivered
+            before_seq: Only mark messages up to and including this sequence number as delivered
         """
-        user1, user2 = sorted([sender.lower(), recipient.lower()])
-        conv_id = f"{user1}_{user2}"
+        conv_id = self.get_conversation_id(sender, recipient)
         
         if conv_id in self.conversations:
             for msg in self.conversations[conv_id]:
-                if msg['from'].lower() == sender.lower() and msg['to'].lower() == recipient.lower():
-                    if before_time is None or msg.get('timestamp', 0) <= before_time:
+                if (canonical_username(msg['from']) == canonical_username(sender)
+                        and canonical_username(msg['to']) == canonical_username(recipient)):
+                    if before_seq is None or msg['seq'] <= before_seq:
                         msg['delivered'] = True
         
     def get_online_users(self, room=None):
@@ -275,11 +330,11 @@ class UserManager:
         Returns:
             bool: True if user is online, False otherwise
         """
-        return username.lower() in self.active_usernames
+        return self.routes.is_online(username)
     
     def is_username_taken(self, username):
         """Check if a username is already in use (case-insensitive)."""
-        return username.lower() in self.active_usernames
+        return self.routes.is_online(username)
 
 # Create a single instance of UserManager
 user_manager = UserManager()
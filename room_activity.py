@@ -0,0 +1,185 @@
+"""
+Typing indicators and read receipts, aggregated into periodic deltas.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple, Any
+
+from config import config
+
+class RoomActivity:
+    """
+    Collects typing and read state and hands it out as batched deltas.
+
+    Features:
+    - Typing events debounced per (sid, room)
+    - Read receipts collapsed into a high-water mark per conversation and reader
+    - Nothing is emitted per event; callers flush dirty state periodically
+    """
+
+    def __init__(self, typing_debounce: float = 2.0, typing_timeout: float = 5.0):
+        """
+        Initialize the activity aggregator.
+
+        Args:
+            typing_debounce: Seconds during which repeated "typing" events from
+                the same socket and room are ignored
+            typing_timeout: Seconds after the last accepted "typing" event before
+                a user is no longer shown as typing
+        """
+        self.typing_debounce = typing_debounce
+        self.typing_timeout = typing_timeout
+        self._lock = threading.Lock()
+        self._last_typing: Dict[Tuple[str, str], float] = {}
+        # {room: {username: expires_at}}; rooms with nobody typing are dropped
+        self._typing: Dict[str, Dict[str, float]] = {}
+        self._dirty_typing = set()
+        # {room: {reader: seq}} and {conversation_id: {reader: seq}}. Kept apart
+        # because room names come from clients and could mimic conversation IDs.
+        self._room_reads: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._direct_reads: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._pending_room_reads: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._pending_direct_reads: Dict[Tuple[str, str], int] = {}
+
+    def set_typing(self, sid: str, room: str, username: str, is_typing: bool) -> bool:
+        """
+        Record a typing start/stop event.
+
+        Args:
+            sid: Socket ID the event came from
+            room: Room the user is typing in
+            username: Display name of the user
+            is_typing: Whether the user started or stopped typing
+
+        Returns:
+            bool: True if the event was accepted, False if it was debounced
+        """
+        now = time.monotonic()
+        key = (sid, room)
+        with self._lock:
+            if is_typing:
+                last = self._last_typing.get(key)
+                if last is not None and now - last < self.typing_debounce:
+                    return False
+                self._last_typing[key] = now
+                typers = self._typing.setdefault(room, {})
+                if username not in typers:
+                    self._dirty_typing.add(room)
+                typers[username] = now + self.typing_timeout
+            else:
+                self._last_typing.pop(key, None)
+                typers = self._typing.get(room)
+                if typers and typers.pop(username, None) is not None:
+                    self._dirty_typing.add(room)
+                    if not typers:
+                        del self._typing[room]
+        return True
+
+    def mark_room_read(self, room: str, reader: str, seq: int) -> bool:
+        """
+        Advance a reader's high-water mark in a room.
+
+        Args:
+            room: Room name
+            reader: Username of the reader
+            seq: Sequence number of the newest message the reader has seen
+
+        Returns:
+            bool: True if the high-water mark moved forward
+        """
+        with self._lock:
+            marks = self._room_reads[room]
+            if seq <= marks.get(reader, 0):
+                return False
+            marks[reader] = seq
+            self._pending_room_reads[room][reader] = seq
+        return True
+
+    def mark_direct_read(self, conversation: str, reader: str, seq: int, notify: str) -> bool:
+        """
+        Advance a reader's high-water mark in a direct conversation.
+
+        Args:
+            conversation: Conversation ID of the two users
+            reader: Username of the reader
+            seq: Sequence number of the newest message the reader has seen
+            notify: Username of the other participant, who gets the receipt
+
+        Returns:
+            bool: True if the high-water mark moved forward
+        """
+        with self._lock:
+            marks = self._direct_reads[conversation]
+            if seq <= marks.get(reader, 0):
+                return False
+            marks[reader] = seq
+            self._pending_direct_reads[(notify, reader)] = seq
+        return True
+
+    def get_room_read_mark(self, room: str, reader: str) -> int:
+        """Get a reader's high-water mark in a room (0 if none)."""
+        return self._room_reads.get(room, {}).get(reader, 0)
+
+    def get_direct_read_mark(self, conversation: str, reader: str) -> int:
+        """Get a reader's high-water mark in a direct conversation (0 if none)."""
+        return self._direct_reads.get(conversation, {}).get(reader, 0)
+
+    def remove_sid(self, sid: str, room: str, username: str, last_session: bool = True):
+        """
+        Clear typing state for a socket that left the room.
+
+        Args:
+            sid: Socket ID that left
+            room: Room the socket was in
+            username: Display name of the user
+            last_session: Whether this was the user's last live session; if not,
+                the user's typing indicator is left to expire on its own
+        """
+        if last_session:
+            self.set_typing(sid, room, username, False)
+            return
+        with self._lock:
+            self._last_typing.pop((sid, room), None)
+
+    def flush(self) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Collect all changes since the last flush.
+
+        Returns:
+            Tuple: ({room: {'typing': [...], 'read': {username: seq}}},
+                    [{'to': username, 'username': reader, 'seq': seq}, ...])
+        """
+        now = time.monotonic()
+        with self._lock:
+            for room, typers in self._typing.items():
+                expired = [u for u, expires_at in typers.items() if expires_at <= now]
+                for username in expired:
+                    del typers[username]
+                if expired:
+                    self._dirty_typing.add(room)
+
+            room_deltas: Dict[str, Dict[str, Any]] = {}
+            for room in self._dirty_typing:
+                room_deltas[room] = {'typing': sorted(self._typing.get(room, ()))}
+            for room in [room for room, typers in self._typing.items() if not typers]:
+                del self._typing[room]
+            for room, reads in self._pending_room_reads.items():
+                room_deltas.setdefault(room, {})['read'] = reads
+
+            direct_receipts = [
+                {'to': to, 'username': reader, 'seq': seq}
+                for (to, reader), seq in self._pending_direct_reads.items()
+            ]
+
+            self._dirty_typing = set()
+            self._pending_room_reads = defaultdict(dict)
+            self._pending_direct_reads = {}
+
+        return room_deltas, direct_receipts
+
+# Global room activity instance
+room_activity = RoomActivity(
+    typing_debounce=config.TYPING_DEBOUNCE,
+    typing_timeout=config.TYPING_TIMEOUT
+)
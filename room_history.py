@@ -0,0 +1,73 @@
+"""
+Per-room recent message history used to backfill users when they join.
+"""
+import json
+from collections import deque
+from typing import Deque, Dict, Any, Optional
+
+from config import config
+
+class RoomHistory:
+    """
+    A fixed-size ring buffer of recent broadcast messages for each room.
+
+    Features:
+    - Bounded memory per room (oldest messages are dropped first)
+    - Pre-serialized backfill batch, cached per room
+    - Cache invalidated only when a new message arrives in the room
+    """
+
+    def __init__(self, size: int = 50):
+        """
+        Initialize the room history.
+
+        Args:
+            size: Maximum number of messages kept per room
+        """
+        self.size = size
+        self.rooms: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._serialized: Dict[str, bytes] = {}
+
+    def add_message(self, room: str, message_data: Dict[str, Any]):
+        """
+        Record a broadcast message in the room's history.
+
+        Args:
+            room: Room the message was broadcast to
+            message_data: Message payload as sent to the room
+        """
+        if self.size <= 0:
+            return
+
+        history = self.rooms.get(room)
+        if history is None:
+            history = self.rooms[room] = deque(maxlen=self.size)
+
+        # The temp ID only means something to the sender's own client
+        history.append({k: v for k, v in message_data.items() if k != 'tempId'})
+        self._serialized.pop(room, None)
+
+    def get_serialized(self, room: str) -> Optional[bytes]:
+        """
+        Get the room's history as a single UTF-8 encoded JSON batch.
+
+        The batch is built once and reused for every join until the next
+        message arrives in the room. Being bytes, it is sent as a binary
+        attachment without being encoded again per client.
+
+        Args:
+            room: Room to get history for
+
+        Returns:
+            Optional[bytes]: JSON array of messages, or None if the room has no history
+        """
+        blob = self._serialized.get(room)
+        if blob is None:
+            history = self.rooms.get(room)
+            if not history:
+                return None
+            blob = self._serialized[room] = json.dumps(list(history)).encode()
+        return blob
+
+# Global room history instance
+room_history = RoomHistory(size=config.ROOM_HISTORY_SIZE)
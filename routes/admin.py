@@ -0,0 +1,50 @@
+"""
+Admin HTTP routes for inspecting the running chat server.
+"""
+import hmac
+from flask import Blueprint, abort, jsonify, request
+
+from config import config
+from instrumentation import handler_profiler
+
+# Create a Blueprint for admin routes
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+@admin_bp.before_request
+def require_admin_token():
+    """Hide admin routes unless a matching X-Admin-Token header is sent."""
+    token = request.headers.get('X-Admin-Token', '')
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(token, config.ADMIN_TOKEN):
+        abort(404)
+
+@admin_bp.route('/handlers')
+def handler_stats():
+    """Per-event Socket.IO handler statistics (requires PROFILE_HANDLERS)."""
+    return jsonify({
+        'enabled': config.PROFILE_HANDLERS,
+        'slow_threshold_ms': config.SLOW_HANDLER_THRESHOLD_MS,
+        'handlers': handler_profiler.get_stats()
+    })
+
+@admin_bp.route('/profiler', methods=['GET', 'POST'])
+def profiler():
+    """
+    Inspect or control the sampling profiler.
+
+    POST with ?action=start|stop|reset to toggle sampling or clear results.
+    """
+    if request.method == 'POST':
+        action = request.args.get('action')
+        if action == 'start':
+            handler_profiler.start_sampling()
+        elif action == 'stop':
+            handler_profiler.stop_sampling()
+        elif action == 'reset':
+            handler_profiler.reset()
+        else:
+            abort(400)
+
+    return jsonify({
+        'sampling': handler_profiler.sampling,
+        'stacks': handler_profiler.get_profile(request.args.get('limit', 20, type=int))
+    })
@@ -1,7 +1,7 @@
 """
 HTTP routes for the chat application.
 """
-from flask import Blueprint, render_template
+from flask import Blueprint, current_app, jsonify, render_template
 
 # Create a Blueprint for main routes
 
@@ -12,3 +12,13 @@ main_bp = Blueprint('main', __name__)
 def index():
     """Render the main chat interface."""
     return render_template('index.html')
+
+@main_bp.route('/ready')
+def ready():
+    """Readiness check: 200 while all background workers are running, 503 if any has stopped."""
+    workers = {
+        name: 'running' if thread.is_alive() else 'stopped'
+        for name, thread in current_app.extensions.get('workers', {}).items()
+    }
+    ready = all(state == 'running' for state in workers.values())
+    return jsonify({'ready': ready, 'workers': workers}), 200 if ready else 503
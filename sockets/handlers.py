@@ -4,15 +4,31 @@ Socket.IO event handlers for the chat application.
 import time
 from flask import request
 from flask_socketio import emit, join_room, leave_room
-from datetime import datetime
 import uuid
 # Import the shared instances using relative imports to avoid circular imports
 from models.user import user_manager  # Changed from app.models.user
 from config import config  # Changed from app.config
 from message_queue import message_queue  # Import our message queue
+from room_history import room_history
+from room_activity import room_activity
+from timestamps import timestamp_service
+from instrumentation import handler_profiler
+from mentions import parse_mentions
+from models.routing import canonical_username
 
 def register_socket_handlers(socketio):
-    """Register all socket event handlers."""
+    """
+    Register all socket event handlers and start the background workers.
+    
+    Args:
+        socketio: SocketIO instance to register the handlers on
+        
+    Returns:
+        dict: {name: Thread} of the started background workers
+    """
+    # Handlers are registered through `on`, which adds timing when profiling is enabled
+    on = handler_profiler.on(socketio) if config.PROFILE_HANDLERS else socketio.on
+    
     # Set up message queue callbacks
     def on_message(msg):
         print(f"[Queue] New message queued: {msg['id']} from user {msg['user_id']}")
@@ -28,7 +44,7 @@ def register_socket_handlers(socketio):
     message_queue.register_callback('on_retry', on_retry)
     message_queue.register_callback('on_ack', on_ack)
     
-    # Start retry thread
+    # Retry loop for unacknowledged messages
     def retry_loop():
         while True:
             retried = message_queue.retry_unacknowledged()
@@ -36,15 +52,32 @@ def register_socket_handlers(socketio):
                 print(f"[Queue] Retried {len(retried)} unacknowledged messages")
             time.sleep(5)  # Check every 5 seconds
     
+    # Flush typing indicators and read receipts as periodic batched deltas
+    def activity_loop():
+        while True:
+            time.sleep(config.ACTIVITY_FLUSH_INTERVAL)
+            room_deltas, direct_receipts = room_activity.flush()
+            for room, delta in room_deltas.items():
+                socketio.emit('room_activity', {'room': room, **delta}, room=room)
+            for receipt in direct_receipts:
+                for target_sid in user_manager.get_sids(receipt['to']):
+                    socketio.emit('read_receipt', {
+                        'username': receipt['username'],
+                        'seq': receipt['seq']
+                    }, room=target_sid)
+    
+    # Start worker threads
     import threading
     retry_thread = threading.Thread(target=retry_loop, daemon=True)
     retry_thread.start()
+    activity_thread = threading.Thread(target=activity_loop, daemon=True)
+    activity_thread.start()
     
-    @socketio.on('connect')
+    @on('connect')
     def handle_connect():
         print('Client connected:', request.sid)
 
-    @socketio.on('disconnect')
+    @on('disconnect')
     def handle_disconnect():
         user_sid = request.sid
         user_data = user_manager.remove_user(user_sid)
@@ -57,15 +90,20 @@ def register_socket_handlers(socketio):
         username_lower = user_data['username_lower']
         
         print(f"User {username} (sid: {user_sid}) is disconnecting...")
+        room_activity.remove_sid(user_sid, room, username, last_session=not user_data['online'])
         leave_room(room)
         
-        print(f"User {username} fully disconnected. Active users: {user_manager.active_usernames}")
+        print(f"User {username} fully disconnected. Active users: {user_manager.get_active_usernames()}")
+        
+        # The user is still connected from another device
+        if user_data['online']:
+            return
         
         # Notify the room that the user has disconnected
         emit('message', {
             'username': 'System',
             'message': f'{username} has left the chat.',
-            'timestamp': datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT)
+            **timestamp_service.stamp()
         }, room=room)
         
         # Update user status to offline
@@ -76,22 +114,27 @@ def register_socket_handlers(socketio):
         
         print(f'User {username} left room {room}')
 
-    @socketio.on('join')
+    @on('join')
     def on_join(data):
         username = data.get('username')
         room = data.get('room', config.DEFAULT_ROOM)
         
         # Add user to the system
-        username_lower = user_manager.add_user(request.sid, username, room)
+        username_lower, first_session = user_manager.add_user(request.sid, username, room)
         
         join_room(room)
         
         # Debug print
         print(f"User {username} (sid: {request.sid}) joined room {room}")
-        print(f"Current active users: {user_manager.active_usernames}")
+        print(f"Current active users: {user_manager.get_active_usernames()}")
+        
+        # Backfill recent room history as one cached, pre-serialized batch
+        history = room_history.get_serialized(room)
+        if history:
+            emit('room_history', history, room=request.sid)
         
         # Get any undelivered messages
-        buffered_messages = user_manager.get_offline_messages(username)
+        buffered_messages = user_manager.get_offline_messages(username, request.sid)
         if buffered_messages:
             print(f"Found {len(buffered_messages)} buffered messages for {username}")
             for msg in buffered_messages:
@@ -101,15 +144,21 @@ def register_socket_handlers(socketio):
                     user_manager.mark_messages_delivered(
                         msg.get('username'),  # sender
                         username,  # recipient (current user)
-                        before_time=msg.get('timestamp')
+                        before_seq=msg.get('seq')
                     )
                 emit('message', {**msg, 'status': 'delivered'}, room=request.sid)
         
+        print(f'User {username} joined room {room}')
+        
+        # The user is already connected from another device
+        if not first_session:
+            return
+        
         # Notify room about the new user
         emit('message', {
             'username': 'System',
             'message': f'{username} has joined the room.',
-            'timestamp': datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT)
+            **timestamp_service.stamp()
         }, room=room)
         
         # Update user status to online
@@ -117,10 +166,8 @@ def register_socket_handlers(socketio):
             'username': username,
             'status': 'online'
         }, room=room)
-        
-        print(f'User {username} joined room {room}')
 
-    @socketio.on('message')
+    @on('message')
     def handle_message(data):
         user_sid = request.sid
         user_data = user_manager.get_user(user_sid)
@@ -137,58 +184,68 @@ def register_socket_handlers(socketio):
             return
             
         print(f"Message from {sender_username} in room {room}: {message}")
+        room_activity.set_typing(user_sid, room, sender_username, False)
+        
+        online_users = []
+        offline_users = []
         
         # Create message data with unique ID and metadata
         message_data = {
             'id': str(uuid.uuid4()),  # Generate a unique ID for this message
             'username': sender_username,
             'message': message,
-            'timestamp': datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT),
+            **timestamp_service.stamp(),
             'room': room,
             'tempId': temp_msg_id,  # Include the frontend's temp ID
             'type': 'direct' if message.startswith('@') else 'broadcast'
         }
         
-        # Handle direct messages (starting with @username)
+        # Handle direct messages (starting with @username, more @mentions allowed)
         if message.startswith('@'):
-            # Extract target username from message
-            parts = message[1:].split(' ', 1)
-            if len(parts) == 2:
-                target_username, message_content = parts
-                
-                # Update message content to remove the @username
-                message_data['message'] = message_content
-                message_data['original_message'] = message
-                
-                # Add to conversation history
-                user_manager.add_to_conversation(
-                    sender_username, 
-                    target_username, 
-                    message_data
-                )
-                
-                # Check if target user is online
-                target_sid = user_manager.username_to_sid.get(target_username.lower())
-                if target_sid and target_sid in user_manager.users:
-                    # Target is online, send directly
-                    emit('message', {**message_data, 'status': 'delivered'}, room=target_sid)
-                    # Send to sender as well
-                    emit('message', {**message_data, 'status': 'delivered'}, room=user_sid)
-                else:
-                    # Target is offline, store for later
-                    user_manager.add_offline_message(target_username, message_data)
-                    # Let sender know the message was queued
-                    emit('message', {**message_data, 'status': 'queued'}, room=user_sid)
+            recipients, message_content = parse_mentions(message)
+            sender_key = canonical_username(sender_username)
+            recipients = [r for r in recipients if canonical_username(r) != sender_key]
+            if not recipients or not message_content:
+                # Tell the sender instead of dropping it; no ack, nothing was delivered
+                emit('message', {
+                    **message_data,
+                    'status': 'failed',
+                    'error': 'No recipients: start a direct message with @username'
+                             if not recipients else 'Direct message has no text'
+                }, room=user_sid)
+                print(f"[Message] Rejected direct message from {sender_username}: {message}")
+                return
+            # Update message content to remove the leading @usernames
+            message_data['message'] = message_content
+            message_data['original_message'] = message
+            message_data['recipients'] = recipients
+            
+            # Record conversations, buffer for offline recipients, resolve online sessions
+            delivery = user_manager.route_direct_message(sender_username, recipients, message_data)
+            online_users = delivery['online']
+            offline_users = delivery['offline']
+            
+            # One emit reaches every online session of every recipient
+            if delivery['sids']:
+                emit('message', {**message_data, 'status': 'delivered'}, to=delivery['sids'])
+            
+            # Let sender know what was delivered and what was queued, on all their devices
+            emit('message', {
+                **message_data,
+                'status': 'queued' if offline_users else 'delivered',
+                'delivered_to': online_users,
+                'queued_for': offline_users
+            }, to=list(user_manager.get_sids(sender_username)))
         else:
             # Handle broadcast message to room
+            room_history.add_message(room, {**message_data, 'status': 'delivered'})
             room_users = user_manager.get_online_users(room)
             
-            # Send to all online users in the room
+            # Send to all online sessions in the room
             for user in room_users:
-                if user['username'] != sender_username:  # Don't send back to sender yet
-                    user_sid = user_manager.username_to_sid.get(user['username'].lower())
-                    if user_sid:
-                        emit('message', {**message_data, 'status': 'delivered'}, room=user_sid)
+                if user['sid'] != user_sid:  # Don't send back to sender yet
+                    emit('message', {**message_data, 'status': 'delivered'}, room=user['sid'])
+                    online_users.append(user['username'])
             
             # Send to sender with delivered status
             emit('message', {**message_data, 'status': 'delivered'}, room=user_sid)
@@ -198,85 +255,48 @@ def register_socket_handlers(socketio):
             emit('message_ack', {
                 'tempId': temp_msg_id,
                 'msgId': message_data['id'],
-                'status': 'delivered'
+                'status': 'queued' if offline_users else 'delivered'
             }, room=user_sid)
         
         print(f"[Message] Sent to {len(online_users)} online users, buffered for {len(offline_users)} offline users")
     
-    def process_next_message(room):
-        """Process the next message in the queue."""
-        msg = message_queue.get_next_message()
-        if not msg:
+    @on('typing')
+    def handle_typing(data):
+        user_data = user_manager.get_user(request.sid)
+        if not user_data:
+            return
+        
+        # Debounced per (sid, room); the room sees the change in the next activity flush
+        room_activity.set_typing(
+            request.sid,
+            user_data['room'],
+            user_data['username'],
+            bool(data.get('typing', True))
+        )
+    
+    @on('read')
+    def handle_read(data):
+        user_data = user_manager.get_user(request.sid)
+        if not user_data:
             return
-            
-        try:
-            message_data = msg['message']
-            target_room = message_data.get('room', room)
-            
-            # Get all users in the target room
-            room_users = [u for u in user_manager.users.values() if u.get('room') == target_room]
-            
-            # Send to all online users in the room
-            for user in room_users:
-                user_sid = next((sid for sid, u in user_manager.users.items() 
-                               if u.get('username') == user['username']), None)
-                if user_sid:
-                    emit('message', {**message_data, 'status': 'delivered'}, room=user_sid)
-            
-            # Acknowledge the message in the queue
-            message_queue.acknowledge(msg['id'])
-            print(f"[Queue] Processed message {msg['id']} in room {target_room}")
-            
-        except Exception as e:
-            print(f"[Queue] Error processing message {msg.get('id', 'unknown')}: {str(e)}")
-            # The message will be automatically retried if not acknowledged
         
-        # Check if it's a direct message (format: @username message)
-        if message_data.get('message', '').startswith('@'):
-            # Extract the target username and message
-            parts = message_data[1:].split(' ', 1)
-            logging.info(f"Parts: {parts}")
-            if len(parts) == 2:
-                target_username, message_content = parts
-                current_time = datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT)
-                
-                # Create the message data
-                message_data = {
-                    'username': sender_username,
-                    'message': f'(to {target_username}): {message_content}',
-                    'timestamp': current_time,
-                    'is_private': True
-                }
-                
-                # Check if target is online
-                target_user = user_manager.get_user_by_username(target_username)
-                
-                if target_user:
-                    # Send to target user
-                    emit('message', message_data, room=target_user['sid'])
-                    # Also send to sender
-                    emit('message', message_data, room=user_sid)
-                else:
-                    # Buffer the message for when the user comes online
-                    user_manager.add_offline_message(target_username, {
-                        'username': sender_username,
-                        'message': f'(Private): {message_content}',
-                        'timestamp': current_time,
-                        'is_private': True
-                    })
-                    # Notify sender that the message is buffered
-                    emit('message', {
-                        'username': 'System',
-                        'message': f'User {target_username} is offline. Message will be delivered when they come online.',
-                        'timestamp': current_time
-                    }, room=user_sid)
-                return
+        seq = data.get('seq')
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            return
+        # A sequence number that was never issued would pin the high-water mark
+        if not 0 < seq <= timestamp_service.last_seq():
+            return
         
-        # Regular message to the room
-        message_data = {
-            'username': sender_username,
-            'message': message,
-            'timestamp': datetime.now().strftime(config.MESSAGE_TIMESTAMP_FORMAT),
-            'is_private': False
-        }
-        emit('message', message_data, room=room)
\ No newline at end of file
+        reader = user_data['username']
+        other_username = data.get('username')
+        if other_username:
+            # Direct conversation: the receipt goes to the other participant only,
+            # and only for a message they actually sent to the reader
+            if not user_manager.has_message_from(other_username, reader, seq):
+                return
+            conv_id = user_manager.get_conversation_id(reader, other_username)
+            room_activity.mark_direct_read(conv_id, reader, seq, notify=other_username)
+        else:
+            room_activity.mark_room_read(user_data['room'], reader, seq)
+    
+    return {'message_queue_retry': retry_thread, 'activity_flush': activity_thread}
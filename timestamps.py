@@ -0,0 +1,89 @@
+"""
+Server timestamp service for ordering and displaying messages.
+"""
+import itertools
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from config import config
+
+class TimestampService:
+    """
+    Issues numeric server timestamps and sequence numbers for messages.
+
+    Features:
+    - Non-decreasing numeric timestamps (never go backwards with clock adjustments)
+    - Strictly increasing sequence numbers for ordering and watermarks
+    - Display strings cached per second instead of formatted per message
+    """
+
+    def __init__(self, timestamp_format: str = '%H:%M:%S'):
+        """
+        Initialize the timestamp service.
+
+        Args:
+            timestamp_format: strftime format for display timestamps. Formatted
+                strings are cached per second, so sub-second directives are not supported.
+        """
+        self.timestamp_format = timestamp_format
+        self._seq = itertools.count(1)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self._last_ts = 0.0
+        self._cached: Tuple[Optional[int], str] = (None, '')
+
+    def now(self) -> float:
+        """Get the current server timestamp in seconds, never lower than the last one issued."""
+        ts = time.time()
+        with self._lock:
+            if ts < self._last_ts:
+                ts = self._last_ts
+            else:
+                self._last_ts = ts
+        return ts
+
+    def next_seq(self) -> int:
+        """Get the next message sequence number."""
+        seq = next(self._seq)
+        self._last_seq = seq
+        return seq
+
+    def last_seq(self) -> int:
+        """Get the most recently issued sequence number (0 if none yet)."""
+        return self._last_seq
+
+    def format(self, ts: float) -> str:
+        """
+        Format a server timestamp for display.
+
+        Args:
+            ts: Server timestamp in seconds
+
+        Returns:
+            str: Timestamp formatted with the configured format
+        """
+        second = int(ts)
+        cached_second, formatted = self._cached
+        if second != cached_second:
+            formatted = time.strftime(self.timestamp_format, time.localtime(second))
+            # Swap second and string together so readers never see a mismatched pair
+            self._cached = (second, formatted)
+        return formatted
+
+    def stamp(self) -> Dict[str, Any]:
+        """
+        Issue the timestamp fields for a new message.
+
+        Returns:
+            Dict: 'timestamp' (display string), 'server_ts' (float) and 'seq' (int)
+        """
+        ts = self.now()
+        return {
+            'timestamp': self.format(ts),
+            'server_ts': ts,
+            'seq': self.next_seq()
+        }
+
+# Global timestamp service instance
+timestamp_service = TimestampService(config.MESSAGE_TIMESTAMP_FORMAT)